@@ -9,7 +9,7 @@ Implementation of exponentially weighted frecency (similar to http://mathb.in/70
 * TODO: https://read-the-docs.readthedocs.org/en/latest/getting_started.html
 * TODO: Automatic half-life determination based on overall usage.
 * TODO: Standard arithmetic operations, where 2nd argument can be Frecency or number
-* TODO: Overflow and underflow detection
+* TODO: Underflow detection  (overflow and precision loss are reported by frecency.instrumentation)
 * TODO: Allow timescale and time0 to be changed on the fly (preserving present value)
 
 
@@ -0,0 +1,287 @@
+"""
+Opt-in instrumentation for Frecency, WeightedAverage and Bootstrap objects.
+
+Nothing here is active until enable() is called: it swaps instrumented
+wrappers onto the hot methods, and disable() puts the originals back, so
+there is no overhead at all while instrumentation is off.
+
+While enabled we keep operation counters, timing histograms, and counts of
+numeric-health events, and call any registered callbacks when an operation
+takes a Frecency value across one of these limits:
+
+* 'precision' -- |log2_value| is so large that the spacing between adjacent
+  float64 values is no longer negligible, so small increments are lost.
+* 'overflow' -- the present weight is close to (or past) the largest
+  float64, so get_present_weight() will soon return inf.
+* 'nan' -- log2_value has become NaN, usually from a negative value_added
+  or multiplier.
+
+Each event fires once, on the operation that crosses the limit; later
+operations on a value that is already past the limit are not reported again.
+
+Timings are self-time: an instrumented method that calls other instrumented
+methods (WeightedAverage._adjust_offset merges its accumulators with
+Frecency._increment_by_frecency) is not charged for their time.
+
+To find hot keys, give Instrumentation a *key_func* mapping each instrumented
+object to a key (or None to leave it out); per-key operation counts then
+appear under 'keys' in as_dict().
+
+Usage::
+
+    from frecency import instrumentation
+    instr = instrumentation.enable(
+        instrumentation.Instrumentation(key_func=lambda obj: getattr(obj, 'key', None)))
+    instr.add_callback(lambda kind, frec, log2_value: log.warning(kind))
+    ...
+    metrics = instr.as_dict()
+    instrumentation.disable()
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import functools
+import math
+import threading
+import time
+
+from . import frecency
+from . import weighted_average
+from . import bootstrap
+
+
+# At |log2_value| >= 2**32, one float64 ulp of log2_value is >= 2**-20,
+# i.e. a relative error of roughly 1e-6 in the weight it represents.
+PRECISION_LOG2_LIMIT = 2. ** 32
+# The largest float64 is just under 2**1024
+OVERFLOW_LOG2_LIMIT = 1000.
+# Upper bounds (in seconds) of the timing histogram buckets; the last bucket is unbounded
+DEFAULT_TIMING_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.)
+
+# Distinct keys tracked per Instrumentation; calls on further keys are only counted in total
+DEFAULT_MAX_KEYS = 1000
+
+NUMERIC_EVENT_KINDS = ('precision', 'overflow', 'nan')
+
+_timer = getattr(time, 'perf_counter', time.time)  # perf_counter is unavailable on Python 2
+
+
+class Instrumentation(object):
+    """Collects operation counters, timing histograms and numeric-health
+    events while installed with enable()."""
+    def __init__(self,
+                 precision_log2_limit=PRECISION_LOG2_LIMIT,
+                 overflow_log2_limit=OVERFLOW_LOG2_LIMIT,
+                 timing_buckets=DEFAULT_TIMING_BUCKETS,
+                 key_func=None,
+                 max_keys=DEFAULT_MAX_KEYS):
+        """
+        * *precision_log2_limit* is the |log2_value| at which a 'precision' event fires.
+        * *overflow_log2_limit* is the log2 of the present weight at which an 'overflow' event fires.
+        * *timing_buckets* are the increasing upper bounds, in seconds, of the timing histogram buckets.
+        * *key_func* maps an instrumented Frecency, WeightedAverage or Bootstrap object to a key
+          (e.g. a string) for per-key counters, or to None to leave it out.  (Defaults to no per-key counters.)
+        * *max_keys* caps the number of distinct keys tracked.  Once full, calls on new keys are
+          counted in 'untracked_key_calls' instead.
+        """
+        self.precision_log2_limit = precision_log2_limit
+        self.overflow_log2_limit = overflow_log2_limit
+        self.timing_buckets = tuple(timing_buckets)
+        self.key_func = key_func
+        self.max_keys = max_keys
+        self.callbacks = []
+        self._local = threading.local()  # Per-thread time spent in nested instrumented calls
+        self.reset()
+
+    def reset(self):
+        """Zero all counters, histograms, numeric event counts and per-key counters."""
+        self.counters = {}
+        self.timings = {}
+        self.numeric_events = dict((kind, 0) for kind in NUMERIC_EVENT_KINDS)
+        self.key_counters = {}
+        self.untracked_key_calls = 0
+
+    def add_callback(self, callback):
+        """Register callback(kind, frecency, log2_value) to be called on each numeric event."""
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def record(self, operation, duration, obj=None):
+        """Count one call of *operation* on *obj* taking *duration* seconds."""
+        self.counters[operation] = self.counters.get(operation, 0) + 1
+        if self.key_func is not None and obj is not None:
+            self._record_key(operation, obj)
+        timing = self.timings.get(operation)
+        if timing is None:
+            timing = {'count': 0,
+                      'total': 0.,
+                      'min': duration,
+                      'max': duration,
+                      'buckets': [0] * (len(self.timing_buckets) + 1)}
+            self.timings[operation] = timing
+        timing['count'] += 1
+        timing['total'] += duration
+        timing['min'] = min(timing['min'], duration)
+        timing['max'] = max(timing['max'], duration)
+        for i, upper_bound in enumerate(self.timing_buckets):
+            if duration <= upper_bound:
+                timing['buckets'][i] += 1
+                break
+        else:
+            timing['buckets'][-1] += 1
+
+    def _record_key(self, operation, obj):
+        key = self.key_func(obj)
+        if key is None:
+            return
+        key_counter = self.key_counters.get(key)
+        if key_counter is None:
+            if len(self.key_counters) >= self.max_keys:
+                self.untracked_key_calls += 1
+                return
+            key_counter = self.key_counters[key] = {}
+        key_counter[operation] = key_counter.get(operation, 0) + 1
+
+    def check_numeric(self, frec, log2_value_before, event_time=None):
+        """Fire numeric events for limits that the Frecency *frec* crossed since
+        it held *log2_value_before*, evaluated at event_time (if given) or present time."""
+        if not event_time:
+            event_time = time.time()
+        log2_value = frec.log2_value
+        kinds_before = self._numeric_kinds(frec, log2_value_before, event_time)
+        for kind in self._numeric_kinds(frec, log2_value, event_time):
+            if kind not in kinds_before:
+                self.numeric_events[kind] += 1
+                for callback in self.callbacks:
+                    callback(kind, frec, log2_value)
+
+    def _numeric_kinds(self, frec, log2_value, event_time):
+        """Return the kinds of numeric limit that *log2_value* is past, in NUMERIC_EVENT_KINDS order."""
+        if math.isnan(log2_value):
+            return ['nan']
+        if math.isinf(log2_value) and log2_value < 0:
+            return []  # An empty Frecency is perfectly healthy
+        kinds = []
+        if abs(log2_value) >= self.precision_log2_limit:
+            kinds.append('precision')
+        present_log2_weight = log2_value - (event_time - frec.time0) / frec.timescale
+        if present_log2_weight >= self.overflow_log2_limit:
+            kinds.append('overflow')
+        return kinds
+
+    def as_dict(self):
+        """Return a snapshot of all metrics as plain dicts, lists and numbers."""
+        bucket_labels = [repr(upper_bound) for upper_bound in self.timing_buckets] + ['+Inf']
+        timings = {}
+        for operation, timing in self.timings.items():
+            timings[operation] = {'count': timing['count'],
+                                  'total': timing['total'],
+                                  'min': timing['min'],
+                                  'max': timing['max'],
+                                  'buckets': dict(zip(bucket_labels, timing['buckets']))}
+        return {'counters': dict(self.counters),
+                'timings': timings,
+                'numeric_events': dict(self.numeric_events),
+                'keys': dict((key, dict(key_counter)) for key, key_counter in self.key_counters.items()),
+                'untracked_key_calls': self.untracked_key_calls}
+
+
+_active = None
+_originals = {}  # (class, method name) -> original function
+
+
+def _timed_call(instr, name, method, obj, args, kwargs, check_numeric=False, event_time=None):
+    """Call method(obj, *args, **kwargs), recording its self-time under *name*:
+    the whole time spent in nested instrumented calls, including their own
+    bookkeeping, is subtracted.  If *check_numeric*, also check obj's numeric health."""
+    local = instr._local
+    entry = _timer()
+    outer_nested_time = getattr(local, 'nested_time', 0.)
+    local.nested_time = 0.
+    try:
+        if check_numeric:
+            log2_value_before = obj.log2_value
+        start = _timer()
+        result = method(obj, *args, **kwargs)
+        instr.record(name, _timer() - start - local.nested_time, obj)
+        if check_numeric:
+            instr.check_numeric(obj, log2_value_before, event_time)
+        return result
+    finally:
+        local.nested_time = outer_nested_time + (_timer() - entry)
+
+
+def _instrument_frecency_method(name, method):
+    """Wrap a Frecency method that changes log2_value, timing it and checking numeric health."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instr = _active
+        if instr is None:  # Bound method kept from before disable()
+            return method(self, *args, **kwargs)
+        return _timed_call(instr, name, method, self, args, kwargs, check_numeric=True)
+    return wrapper
+
+
+def _instrument_increment(name, method):
+    """Like _instrument_frecency_method, but checks numeric health at the event_time of the increment."""
+    @functools.wraps(method)
+    def wrapper(self, value_added=1., event_time=None):
+        instr = _active
+        if instr is None:  # Bound method kept from before disable()
+            return method(self, value_added, event_time)
+        return _timed_call(instr, name, method, self, (value_added, event_time), {},
+                           check_numeric=True, event_time=event_time)
+    return wrapper
+
+
+def _instrument_method(name, method):
+    """Wrap any other method, only timing it."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instr = _active
+        if instr is None:  # Bound method kept from before disable()
+            return method(self, *args, **kwargs)
+        return _timed_call(instr, name, method, self, args, kwargs)
+    return wrapper
+
+
+_INSTRUMENTED_METHODS = (
+    (frecency.Frecency, 'increment', _instrument_increment),
+    (frecency.Frecency, '_increment_by_frecency', _instrument_frecency_method),
+    (weighted_average.WeightedAverage, '_adjust_offset', _instrument_method),
+    (bootstrap.Bootstrap, 'get_samples', _instrument_method),
+)
+
+
+def enable(instrumentation=None):
+    """Start collecting metrics into *instrumentation* (a new Instrumentation
+    if not given), replacing any previously enabled one.  Returns it."""
+    global _active
+    if instrumentation is None:
+        instrumentation = Instrumentation()
+    _active = instrumentation
+    for cls, method_name, make_wrapper in _INSTRUMENTED_METHODS:
+        key = (cls, method_name)
+        if key not in _originals:
+            _originals[key] = cls.__dict__[method_name]
+            operation = '{}.{}'.format(cls.__name__, method_name)
+            setattr(cls, method_name, make_wrapper(operation, _originals[key]))
+    return instrumentation
+
+
+def disable():
+    """Stop collecting metrics and restore the uninstrumented methods.
+    Returns the Instrumentation that was active (or None)."""
+    global _active
+    for (cls, method_name), method in _originals.items():
+        setattr(cls, method_name, method)
+    _originals.clear()
+    instrumentation, _active = _active, None
+    return instrumentation
+
+
+def get_instrumentation():
+    """Return the active Instrumentation, or None if instrumentation is off."""
+    return _active
@@ -10,6 +10,7 @@ import numpy
 from frecency import *
 from frecency.weighted_average import WeightedAverage
 from frecency.bootstrap import Bootstrap
+from frecency import instrumentation
 
 
 def approx_equal(float1, float2, tol=0.001):
@@ -123,3 +124,104 @@ def test_bootstrap():
     assert sample_counts2[1] == 0
     
 
+
+def test_instrumentation():
+    now = time.time()
+    originals = [Frecency.__dict__['increment'],
+                 Frecency.__dict__['_increment_by_frecency'],
+                 WeightedAverage.__dict__['_adjust_offset'],
+                 Bootstrap.__dict__['get_samples']]
+    instrumentation.enable()
+    # Enabling again just swaps the Instrumentation; methods are not wrapped twice
+    instr = instrumentation.enable()
+    try:
+        assert instrumentation.get_instrumentation() is instr
+        events = []
+        instr.add_callback(lambda kind, frec, log2_value: events.append(kind))
+        f1 = Frecency(timescale=10.)
+        f1.increment(event_time=now)
+        f1.increment(2, now)
+        assert approx_equal(f1.get_present_weight(event_time=now), 3.)
+        w = WeightedAverage()
+        w.add_sample(-1., event_time=now)
+        b = Bootstrap()
+        b.add_sample(1., event_time=now)
+        b.get_samples(10)
+        assert events == []
+        # A tiny timescale puts log2_value far beyond float64 precision;
+        # the event fires only on the increment that crosses the limit
+        f2 = Frecency(timescale=1e-6)
+        for i in range(3):
+            f2.increment(event_time=now)
+        # A present weight of 2**1010 is close to overflow
+        f3 = Frecency(timescale=10.)
+        f3.increment(2. ** 1010, event_time=now)
+        # A negative value_added is reported as NaN, not overflow
+        f4 = Frecency()
+        with numpy.errstate(invalid='ignore'):
+            f4.increment(-1.)
+        assert events == ['precision', 'overflow', 'nan']
+        f5 = Frecency(timescale=10.)
+        increment_f5 = f5.increment
+        metrics = instr.as_dict()
+    finally:
+        assert instrumentation.disable() is instr
+    assert [Frecency.__dict__['increment'],
+            Frecency.__dict__['_increment_by_frecency'],
+            WeightedAverage.__dict__['_adjust_offset'],
+            Bootstrap.__dict__['get_samples']] == originals
+    assert instrumentation.get_instrumentation() is None
+    # A bound method kept from while enabled still works, uninstrumented
+    increment_f5(1., now)
+    assert approx_equal(f5.get_present_weight(event_time=now), 1.)
+    assert instr.as_dict() == metrics
+    # 6 from f1, f2 and f3, 1 from f4, plus 3 from w.add_sample and 1 from b.add_sample
+    assert metrics['counters']['Frecency.increment'] == 11
+    # w._adjust_offset merges accumulators 3 times
+    assert metrics['counters']['Frecency._increment_by_frecency'] == 3
+    assert metrics['counters']['WeightedAverage._adjust_offset'] == 1
+    assert metrics['counters']['Bootstrap.get_samples'] == 1
+    assert metrics['numeric_events'] == {'precision': 1, 'overflow': 1, 'nan': 1}
+    timing = metrics['timings']['Frecency.increment']
+    assert timing['count'] == 11
+    assert sum(timing['buckets'].values()) == 11
+    assert 0 <= timing['min'] <= timing['max'] <= timing['total']
+
+
+def test_instrumentation_keys_and_nested_timing():
+    now = time.time()
+    delay = 0.01
+
+    def slow_key(obj):
+        # Makes the bookkeeping of every wrapped Frecency call slow
+        if isinstance(obj, Frecency):
+            time.sleep(delay)
+        return getattr(obj, 'key', None)
+
+    instr = instrumentation.enable(instrumentation.Instrumentation(key_func=slow_key, max_keys=2))
+    try:
+        w = WeightedAverage()
+        w.key = 'w'
+        w.n_sum.key = 'w.n_sum'
+        w.add_sample(-1., event_time=now)
+        f = Frecency()
+        f.key = 'f'
+        f.increment(event_time=now)
+        f.increment(event_time=now)
+        b = Bootstrap()
+        b.add_sample(1., event_time=now)
+        b.get_samples(1)
+        metrics = instr.as_dict()
+    finally:
+        instrumentation.disable()
+    # Only objects with a key are counted, up to max_keys distinct keys
+    assert metrics['keys'] == {'w': {'WeightedAverage._adjust_offset': 1},
+                               'w.n_sum': {'Frecency.increment': 1}}
+    assert metrics['untracked_key_calls'] == 2
+    # The 3 nested _increment_by_frecency calls, with their slow bookkeeping,
+    # are not charged to _adjust_offset
+    inner_timing = metrics['timings']['Frecency._increment_by_frecency']
+    assert inner_timing['count'] == 3
+    outer_timing = metrics['timings']['WeightedAverage._adjust_offset']
+    assert outer_timing['count'] == 1
+    assert outer_timing['total'] < delay